@@ -56,6 +56,11 @@ def cache_this(key_fn, value_fn, lru_size):  # type: ignore
     return wrapper
 
 
+_integer_squareroot = integer_squareroot
+integer_squareroot = cache_this(
+    lambda n: n,
+    _integer_squareroot, lru_size=10)
+
 _compute_shuffled_index = compute_shuffled_index
 compute_shuffled_index = cache_this(
     lambda index, index_count, seed: (index, index_count, seed),
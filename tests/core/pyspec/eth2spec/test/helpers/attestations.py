@@ -379,7 +379,8 @@ _prep_state_cache_dict = LRU(size=10)
 def cached_prepare_state_with_attestations(spec, state):
     """
     Cached version of prepare_state_with_attestations,
-    but does not return anything, and does not support a participation fn argument
+    but does not support a participation fn argument.
+    Note: the returned attestations are signed according to the BLS setting at the time they were cached.
     """
     # If the pre-state is not already known in the LRU, then take it,
     # prepare it with attestations, and put it in the LRU.
@@ -387,8 +388,14 @@ def cached_prepare_state_with_attestations(spec, state):
     key = (spec.fork, state.hash_tree_root())
     global _prep_state_cache_dict
     if key not in _prep_state_cache_dict:
-        prepare_state_with_attestations(spec, state)
-        _prep_state_cache_dict[key] = state.get_backing()  # cache the tree structure, not the view wrapping it.
+        attestations = prepare_state_with_attestations(spec, state)
+        # cache the tree structures, not the views wrapping them.
+        _prep_state_cache_dict[key] = (
+            state.get_backing(),
+            [attestation.get_backing() for attestation in attestations],
+        )
 
     # Put the LRU cache result into the state view, as if we transitioned the original view
-    state.set_backing(_prep_state_cache_dict[key])
+    state_backing, attestation_backings = _prep_state_cache_dict[key]
+    state.set_backing(state_backing)
+    return [spec.Attestation(backing=backing) for backing in attestation_backings]
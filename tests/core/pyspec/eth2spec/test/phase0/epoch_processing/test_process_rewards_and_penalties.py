@@ -18,10 +18,12 @@ from eth2spec.test.helpers.attestations import (
     get_valid_attestation,
     sign_attestation,
     prepare_state_with_attestations,
+    cached_prepare_state_with_attestations,
 )
 from eth2spec.test.helpers.rewards import leaking
 from eth2spec.test.helpers.attester_slashings import get_indexed_attestation_participants
 from eth2spec.test.helpers.epoch_processing import run_epoch_processing_with
+from itertools import chain
 from random import Random
 
 
@@ -29,54 +31,51 @@ def run_process_rewards_and_penalties(spec, state):
     yield from run_epoch_processing_with(spec, state, 'process_rewards_and_penalties')
 
 
-def validate_resulting_balances(spec, pre_state, post_state, attestations):
-    attesting_indices = spec.get_unslashed_attesting_indices(post_state, attestations)
-    current_epoch = spec.get_current_epoch(post_state)
-
-    for index in range(len(pre_state.validators)):
-        if not spec.is_active_validator(pre_state.validators[index], current_epoch):
-            assert post_state.balances[index] == pre_state.balances[index]
-        elif not is_post_altair(spec):
-            proposer_indices = [a.proposer_index for a in post_state.previous_epoch_attestations]
-            if spec.is_in_inactivity_leak(post_state):
-                # Proposers can still make money during a leak before LIGHTCLIENT_PATCH
-                if index in proposer_indices and index in attesting_indices:
-                    assert post_state.balances[index] > pre_state.balances[index]
-                elif index in attesting_indices:
-                    # If not proposer but participated optimally, should have exactly neutral balance
-                    assert post_state.balances[index] == pre_state.balances[index]
-                else:
-                    assert post_state.balances[index] < pre_state.balances[index]
+def get_balances(state):
+    # Read the balances out of the SSZ list in one pass, instead of a tree lookup per index
+    return list(state.balances.readonly_iter())
+
+
+def validate_resulting_balances(spec, pre_balances, post_state, attestations):
+    attesting_indices = set(spec.get_unslashed_attesting_indices(post_state, attestations))
+    if not is_post_altair(spec):
+        proposer_indices = set(a.proposer_index for a in post_state.previous_epoch_attestations)
+    else:
+        proposer_indices = set()
+    # Validator records are not modified by rewards and penalties processing
+    active_indices = set(spec.get_active_validator_indices(post_state, spec.get_current_epoch(post_state)))
+    in_leak = spec.is_in_inactivity_leak(post_state)
+    post_balances = get_balances(post_state)
+
+    for index in range(len(post_state.validators)):
+        if index not in active_indices:
+            assert post_balances[index] == pre_balances[index]
+        elif in_leak:
+            # Proposers can still make money during a leak before LIGHTCLIENT_PATCH
+            if index in proposer_indices and index in attesting_indices:
+                assert post_balances[index] > pre_balances[index]
+            elif index in attesting_indices:
+                # If not proposer but participated optimally, should have exactly neutral balance
+                assert post_balances[index] == pre_balances[index]
             else:
-                if index in attesting_indices:
-                    assert post_state.balances[index] > pre_state.balances[index]
-                else:
-                    assert post_state.balances[index] < pre_state.balances[index]
+                assert post_balances[index] < pre_balances[index]
         else:
-            if spec.is_in_inactivity_leak(post_state):
-                if index in attesting_indices:
-                    # If not proposer but participated optimally, should have exactly neutral balance
-                    assert post_state.balances[index] == pre_state.balances[index]
-                else:
-                    assert post_state.balances[index] < pre_state.balances[index]
+            if index in attesting_indices:
+                assert post_balances[index] > pre_balances[index]
             else:
-                if index in attesting_indices:
-                    assert post_state.balances[index] > pre_state.balances[index]
-                else:
-                    assert post_state.balances[index] < pre_state.balances[index]
+                assert post_balances[index] < pre_balances[index]
 
 
 @with_all_phases
 @spec_state_test
 def test_genesis_epoch_no_attestations_no_penalties(spec, state):
-    pre_state = state.copy()
+    pre_balances = get_balances(state)
 
     assert spec.compute_epoch_at_slot(state.slot) == spec.GENESIS_EPOCH
 
     yield from run_process_rewards_and_penalties(spec, state)
 
-    for index in range(len(pre_state.validators)):
-        assert state.balances[index] == pre_state.balances[index]
+    assert get_balances(state) == pre_balances
 
 
 @with_all_phases
@@ -97,19 +96,21 @@ def test_genesis_epoch_full_attestations_no_rewards(spec, state):
     # ensure has not cross the epoch boundary
     assert spec.compute_epoch_at_slot(state.slot) == spec.GENESIS_EPOCH
 
-    pre_state = state.copy()
+    pre_balances = get_balances(state)
 
     yield from run_process_rewards_and_penalties(spec, state)
 
-    for index in range(len(pre_state.validators)):
-        assert state.balances[index] == pre_state.balances[index]
+    assert get_balances(state) == pre_balances
 
 
 @with_phases([PHASE0])
 @spec_state_test
 def test_full_attestations_random_incorrect_fields(spec, state):
-    attestations = prepare_state_with_attestations(spec, state)
+    attestations = cached_prepare_state_with_attestations(spec, state)
+    # Modify detached copies and write the list back to the state once
+    pending_attestations = []
     for i, attestation in enumerate(state.previous_epoch_attestations):
+        attestation = attestation.copy()
         if i % 3 == 0:
             # Mess up some head votes
             attestation.data.beacon_block_root = b'\x56' * 32
@@ -119,6 +120,8 @@ def test_full_attestations_random_incorrect_fields(spec, state):
         if i % 3 == 2:
             # Keep some votes 100% correct
             pass
+        pending_attestations.append(attestation)
+    state.previous_epoch_attestations = pending_attestations
 
     yield from run_process_rewards_and_penalties(spec, state)
 
@@ -133,22 +136,20 @@ def test_full_attestations_random_incorrect_fields(spec, state):
 @with_custom_state(balances_fn=misc_balances, threshold_fn=lambda spec: spec.MAX_EFFECTIVE_BALANCE // 2)
 @single_phase
 def test_full_attestations_misc_balances(spec, state):
-    attestations = prepare_state_with_attestations(spec, state)
+    attestations = cached_prepare_state_with_attestations(spec, state)
 
-    pre_state = state.copy()
+    pre_balances = get_balances(state)
 
     yield from run_process_rewards_and_penalties(spec, state)
 
-    validate_resulting_balances(spec, pre_state, state, attestations)
+    validate_resulting_balances(spec, pre_balances, state, attestations)
     # Check if base rewards are consistent with effective balance.
     brs = {}
     attesting_indices = spec.get_unslashed_attesting_indices(state, attestations)
     for index in attesting_indices:
         br = spec.get_base_reward(state, index)
-        if br in brs:
-            assert brs[br] == state.validators[index].effective_balance
-        else:
-            brs[br] = state.validators[index].effective_balance
+        effective_balance = state.validators[index].effective_balance
+        assert brs.setdefault(br, effective_balance) == effective_balance
 
 
 @with_all_phases
@@ -156,7 +157,7 @@ def test_full_attestations_misc_balances(spec, state):
 @with_custom_state(balances_fn=low_single_balance, threshold_fn=zero_activation_threshold)
 @single_phase
 def test_full_attestations_one_validaor_one_gwei(spec, state):
-    attestations = prepare_state_with_attestations(spec, state)
+    attestations = cached_prepare_state_with_attestations(spec, state)
 
     yield from run_process_rewards_and_penalties(spec, state)
 
@@ -170,41 +171,50 @@ def test_full_attestations_one_validaor_one_gwei(spec, state):
 def test_no_attestations_all_penalties(spec, state):
     # Move to next epoch to ensure rewards/penalties are processed
     next_epoch(spec, state)
-    pre_state = state.copy()
+    pre_balances = get_balances(state)
 
     assert spec.compute_epoch_at_slot(state.slot) == spec.GENESIS_EPOCH + 1
 
     yield from run_process_rewards_and_penalties(spec, state)
 
-    validate_resulting_balances(spec, pre_state, state, [])
+    validate_resulting_balances(spec, pre_balances, state, [])
 
 
 def run_with_participation(spec, state, participation_fn):
-    participated = set()
+    participated_lists = []
 
     def participation_tracker(slot, comm_index, comm):
         att_participants = participation_fn(slot, comm_index, comm)
-        participated.update(att_participants)
+        participated_lists.append(att_participants)
         return att_participants
 
     attestations = prepare_state_with_attestations(spec, state, participation_fn=participation_tracker)
-    pre_state = state.copy()
+    participated = set(chain.from_iterable(participated_lists))
+    pre_balances = get_balances(state)
 
     yield from run_process_rewards_and_penalties(spec, state)
 
     attesting_indices = spec.get_unslashed_attesting_indices(state, attestations)
     assert len(attesting_indices) == len(participated)
 
-    validate_resulting_balances(spec, pre_state, state, attestations)
+    validate_resulting_balances(spec, pre_balances, state, attestations)
+
+
+def random_participation_fn(seed, participant_count_fn):
+    """
+    Return a ``participation_fn`` that samples ``participant_count_fn(len(comm))`` members of each committee.
+    """
+    rng = Random(seed)
+
+    def participation_fn(slot, comm_index, comm):
+        return rng.sample(sorted(comm), participant_count_fn(len(comm)))
+    return participation_fn
 
 
 @with_all_phases
 @spec_state_test
 def test_almost_empty_attestations(spec, state):
-    rng = Random(1234)
-
-    def participation_fn(slot, comm_index, comm):
-        return rng.sample(sorted(comm), 1)
+    participation_fn = random_participation_fn(1234, lambda size: 1)
     yield from run_with_participation(spec, state, participation_fn)
 
 
@@ -212,20 +222,14 @@ def test_almost_empty_attestations(spec, state):
 @spec_state_test
 @leaking()
 def test_almost_empty_attestations_with_leak(spec, state):
-    rng = Random(1234)
-
-    def participation_fn(slot, comm_index, comm):
-        return rng.sample(sorted(comm), 1)
+    participation_fn = random_participation_fn(1234, lambda size: 1)
     yield from run_with_participation(spec, state, participation_fn)
 
 
 @with_all_phases
 @spec_state_test
 def test_random_fill_attestations(spec, state):
-    rng = Random(4567)
-
-    def participation_fn(slot, comm_index, comm):
-        return rng.sample(sorted(comm), len(comm) // 3)
+    participation_fn = random_participation_fn(4567, lambda size: size // 3)
     yield from run_with_participation(spec, state, participation_fn)
 
 
@@ -233,20 +237,14 @@ def test_random_fill_attestations(spec, state):
 @spec_state_test
 @leaking()
 def test_random_fill_attestations_with_leak(spec, state):
-    rng = Random(4567)
-
-    def participation_fn(slot, comm_index, comm):
-        return rng.sample(sorted(comm), len(comm) // 3)
+    participation_fn = random_participation_fn(4567, lambda size: size // 3)
     yield from run_with_participation(spec, state, participation_fn)
 
 
 @with_all_phases
 @spec_state_test
 def test_almost_full_attestations(spec, state):
-    rng = Random(8901)
-
-    def participation_fn(slot, comm_index, comm):
-        return rng.sample(sorted(comm), len(comm) - 1)
+    participation_fn = random_participation_fn(8901, lambda size: size - 1)
     yield from run_with_participation(spec, state, participation_fn)
 
 
@@ -254,10 +252,7 @@ def test_almost_full_attestations(spec, state):
 @spec_state_test
 @leaking()
 def test_almost_full_attestations_with_leak(spec, state):
-    rng = Random(8901)
-
-    def participation_fn(slot, comm_index, comm):
-        return rng.sample(sorted(comm), len(comm) - 1)
+    participation_fn = random_participation_fn(8901, lambda size: size - 1)
     yield from run_with_participation(spec, state, participation_fn)
 
 
@@ -439,7 +434,7 @@ def test_duplicate_participants_different_attestation_3(spec, state):
 @spec_state_test
 # Case when some eligible attestations are slashed. Modifies attesting_balance and consequently rewards/penalties.
 def test_attestations_some_slashed(spec, state):
-    attestations = prepare_state_with_attestations(spec, state)
+    attestations = cached_prepare_state_with_attestations(spec, state)
     attesting_indices_before_slashings = list(spec.get_unslashed_attesting_indices(state, attestations))
 
     # Slash maximum amount of validators allowed per epoch.
@@ -449,11 +444,11 @@ def test_attestations_some_slashed(spec, state):
     if not is_post_altair(spec):
         assert len(state.previous_epoch_attestations) == len(attestations)
 
-    pre_state = state.copy()
+    pre_balances = get_balances(state)
 
     yield from run_process_rewards_and_penalties(spec, state)
 
     attesting_indices = spec.get_unslashed_attesting_indices(state, attestations)
     assert len(attesting_indices) > 0
     assert len(attesting_indices_before_slashings) - len(attesting_indices) == spec.config.MIN_PER_EPOCH_CHURN_LIMIT
-    validate_resulting_balances(spec, pre_state, state, attestations)
+    validate_resulting_balances(spec, pre_balances, state, attestations)